@@ -19,6 +19,7 @@ Options:
   --start-index          Starting shard index (default: 1)
   -g, --group-by-subject Keep each subject within a shard when possible
   -c, --coverage-thr     Mask coverage thresholds START,END (default: 0.08,0.08)
+  -j, --n-jobs           Parallel workers for slice extraction (default: 4)
   -s, --subjects         Quoted space-separated subject IDs (e.g., "sub-001 sub-002")
   -e, --sessions         Quoted space-separated session IDs (e.g., "ses-01 ses-02")
       --dry-run          Do not write shards; print actions
@@ -44,6 +45,7 @@ PREFIX="ADNI"
 START_INDEX=1
 GROUP_BY_SUBJ=0
 COVERAGE_THR="0.10,0.20"
+N_JOBS=4
 
 parse_args() {
   while [ $# -gt 0 ]; do
@@ -58,6 +60,7 @@ parse_args() {
       --start-index) START_INDEX="$2"; shift 2;;
       -g|--group-by-subject) GROUP_BY_SUBJ=1; shift 1;;
       -c|--coverage-thr) COVERAGE_THR="$2"; shift 2;;
+      -j|--n-jobs) N_JOBS="$2"; shift 2;;
       -s|--subjects)
         shift
         while [ $# -gt 0 ]; do
@@ -107,7 +110,8 @@ set -- \
   --shard-size "$SHARD_SIZE" \
   --prefix "$PREFIX" \
   --start-index "$START_INDEX" \
-  --coverage-thresholds "$COVERAGE_THR"
+  --coverage-thresholds "$COVERAGE_THR" \
+  --n-jobs "$N_JOBS"
 
 if [ -n "$OUT_DIR" ]; then
   set -- "$@" --out-dir "$OUT_DIR"
@@ -1,36 +1,75 @@
 from pathlib import Path
+import threading
 import time
-import json
+from typing import Optional
 
 import SimpleITK as sitk
 
+from .utils import save_json
 
-def n4_bias_correct(in_file: Path, out_dir: Path, dry_run: bool = False) -> Path:
-    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-biascorr.nii.gz")
-    if dry_run:
-        return out_path
+# N4 is fitted on a downsampled grid; the bias field is then evaluated at full resolution
+SHRINK_FACTOR = 4
 
-    start = time.time()
-    img = sitk.ReadImage(str(in_file))
+_CORRECTOR = threading.local()
+
+
+def _get_corrector() -> sitk.N4BiasFieldCorrectionImageFilter:
+    """Return a configured N4 filter, built once per thread and reused across calls."""
+    c = getattr(_CORRECTOR, "c", None)
+    if c is None:
+        c = sitk.N4BiasFieldCorrectionImageFilter()
+        # Pinned explicitly (N4ITK defaults except the iteration schedule) so results do not
+        # drift with SimpleITK releases; configured once per thread
+        c.SetMaximumNumberOfIterations([50, 40, 30, 20])
+        c.SetConvergenceThreshold(1e-3)
+        c.SetBiasFieldFullWidthAtHalfMaximum(0.15)
+        c.SetWienerFilterNoise(0.01)
+        c.SetNumberOfHistogramBins(200)
+        c.SetNumberOfControlPoints([4, 4, 4])
+        c.SetSplineOrder(3)
+        _CORRECTOR.c = c
+    return c
+
+
+def n4_bias_correct_arr(img: sitk.Image) -> sitk.Image:
+    """N4-correct an in-memory image; returns a float32 image on the same grid."""
     img_f = sitk.Cast(img, sitk.sitkFloat32)
-    mask = sitk.OtsuThreshold(img_f, 0, 1, 200)
-    mask = sitk.Cast(mask, sitk.sitkUInt8)
-    corrector = sitk.N4BiasFieldCorrectionImageFilter()
-    out = corrector.Execute(img_f, mask)
-    sitk.WriteImage(out, str(out_path))
+    shrink = [SHRINK_FACTOR] * img_f.GetDimension()
+    img_s = sitk.Shrink(img_f, shrink)
+    mask_s = sitk.OtsuThreshold(img_s, 0, 1, 64)
+    mask_s = sitk.Cast(mask_s, sitk.sitkUInt8)
+    corrector = _get_corrector()
+    corrector.Execute(img_s, mask_s)
+    log_bias = sitk.Cast(corrector.GetLogBiasFieldAsImage(img_f), sitk.sitkFloat32)
+    return sitk.Divide(img_f, sitk.Exp(log_bias))
+
 
-    # Write a lightweight JSON log for N4
-    meta = {
+def n4_meta(img: sitk.Image, in_file: Path, out_path: Optional[Path], elapsed: float) -> dict:
+    """Lightweight JSON log for an N4 run."""
+    return {
         "n4_applied": True,
         "method": "SimpleITK.N4BiasFieldCorrection",
-        "elapsed_sec": round(time.time() - start, 3),
+        "elapsed_sec": round(elapsed, 3),
         "input_path": str(in_file),
-        "output_path": str(out_path),
-        "mask_method": "OtsuThreshold(levels=200)",
+        "output_path": str(out_path) if out_path is not None else None,
+        "mask_method": "OtsuThreshold(levels=64)",
+        "shrink_factor": SHRINK_FACTOR,
         "image_size": list(img.GetSize()),
         "image_spacing": list(img.GetSpacing()),
     }
-    with open(str(out_path).replace(".nii.gz", ".json"), "w") as f:
-        json.dump(meta, f, indent=2)
+
+
+def n4_bias_correct(in_file: Path, out_dir: Path, dry_run: bool = False) -> Path:
+    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-biascorr.nii.gz")
+    if dry_run:
+        return out_path
+
+    start = time.time()
+    img = sitk.ReadImage(str(in_file))
+    out = n4_bias_correct_arr(img)
+    sitk.WriteImage(out, str(out_path))
+
+    meta = n4_meta(img, in_file, out_path, time.time() - start)
+    save_json(meta, Path(str(out_path).replace(".nii.gz", ".json")))
 
     return out_path
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from typing import Dict, List
 
@@ -5,9 +6,12 @@ from typing import Dict, List
 def find_sessions(bids_root: Path, subject: str) -> List[str]:
     """Return session directories (ses-*) under a subject."""
     sub_dir = bids_root / subject
-    if not sub_dir.exists():
+    try:
+        # scandir exposes the entry type without an extra stat per entry
+        with os.scandir(sub_dir) as it:
+            sessions = [e.name for e in it if e.name.startswith("ses-") and e.is_dir()]
+    except FileNotFoundError:
         return []
-    sessions = [p.name for p in sub_dir.iterdir() if p.is_dir() and p.name.startswith("ses-")]
     sessions.sort()
     return sessions
 
@@ -17,10 +21,18 @@ def list_modality_files(anat_dir: Path, modalities: List[str]) -> Dict[str, List
 
     Matches filenames like sub-*_ses-*_T1w.nii.gz etc.
     """
+    suffixes = {m: f"_{m}.nii.gz" for m in modalities}
     out: Dict[str, List[Path]] = {m: [] for m in modalities}
-    for m in modalities:
-        out[m] = sorted(anat_dir.glob(f"*_" + m + ".nii.gz"))
+    # Single directory pass instead of one glob per modality
+    with os.scandir(anat_dir) as it:
+        for e in it:
+            if not e.name.endswith(".nii.gz"):
+                continue
+            for m, suf in suffixes.items():
+                if e.name.endswith(suf):
+                    out[m].append(Path(e.path))
+                    break
     # Drop empty modalities
-    out = {k: v for k, v in out.items() if v}
+    out = {k: sorted(v) for k, v in out.items() if v}
     return out
 
@@ -1,56 +1,190 @@
 from pathlib import Path
-import json
 
 import nibabel as nib
 import numpy as np
 
+from .utils import save_json
 
-def _mad(x: np.ndarray) -> float:
-    med = np.median(x)
-    return float(np.median(np.abs(x - med)))
+try:
+    import numba
+except ImportError:  # optional; numpy fallbacks are used instead
+    numba = None
 
+_HIST_BINS = 4096
 
-def robust_normalize(in_file: Path, mask_file: Path, out_dir: Path, dry_run: bool = False) -> Path:
-    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-norm.nii.gz")
-    if dry_run:
-        return out_path
 
-    img = nib.load(str(in_file))
-    data = img.get_fdata().astype(np.float32)
-    m = nib.load(str(mask_file)).get_fdata().astype(bool)
-    if m.sum() < 10:
+def _fast_pct(x: np.ndarray, qs: list[float], bins: int = _HIST_BINS) -> list[float]:
+    """Approximate quantiles (qs in [0, 1]) from a single histogram pass over x."""
+    mn, mx = float(x.min()), float(x.max())
+    if mx <= mn:
+        mn, mx = mn - 0.5, mx + 0.5
+    h, _ = np.histogram(x, bins=bins, range=(mn, mx))
+    return [edge for _, edge in _hist_quantiles(h, mn, mx, qs)]
+
+
+def _hist_quantiles(cnt: np.ndarray, mn: float, mx: float, qs: list[float]) -> list[tuple[int, float]]:
+    """(bin index, left edge) of the bins holding quantiles qs of a histogram over [mn, mx]."""
+    c = np.cumsum(cnt)
+    width = (mx - mn) / len(cnt)
+    out = []
+    for q in qs:
+        i = int(np.searchsorted(c, q * c[-1]))
+        out.append((i, mn + i * width))
+    return out
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, parallel=True)
+    def _masked_range(x, m, center, absdev):
+        # Count, min and max of x (or |x - center|) over m
+        n = 0
+        mn = np.inf
+        mx = -np.inf
+        for i in numba.prange(x.shape[0]):
+            if m[i]:
+                v = x[i]
+                if absdev:
+                    v = abs(v - center)
+                n += 1
+                mn = min(mn, v)
+                mx = max(mx, v)
+        return n, mn, mx
+
+    @numba.njit(cache=True, parallel=True)
+    def _masked_hist(x, m, center, absdev, mn, mx, bins, nchunks):
+        # Per-bin count, sum and sum of squares; one histogram per chunk, merged at the end
+        step = (x.shape[0] + nchunks - 1) // nchunks
+        cnt = np.zeros((nchunks, bins), np.int64)
+        s1 = np.zeros((nchunks, bins), np.float64)
+        s2 = np.zeros((nchunks, bins), np.float64)
+        scale = bins / (mx - mn)
+        for c in numba.prange(nchunks):
+            for i in range(c * step, min(x.shape[0], (c + 1) * step)):
+                if m[i]:
+                    v = x[i]
+                    if absdev:
+                        v = abs(v - center)
+                    b = min(max(int((v - mn) * scale), 0), bins - 1)
+                    cnt[c, b] += 1
+                    s1[c, b] += v
+                    s2[c, b] += v * v
+        return cnt.sum(axis=0), s1.sum(axis=0), s2.sum(axis=0)
+
+    @numba.njit(cache=True, parallel=True, fastmath=True)
+    def _clip_zscore(x, lo, hi, mean, inv_std):
+        for i in numba.prange(x.shape[0]):
+            x[i] = (min(max(x[i], lo), hi) - mean) * inv_std
+
+else:
+    _masked_hist = None
+
+
+def _flat_views(data: np.ndarray, m: np.ndarray):
+    """1-D views of data (writable, no copy) and m in the same element order, or None."""
+    if data.dtype != np.float32:
+        return None
+    if data.flags.c_contiguous:
+        order = "C"
+    elif data.flags.f_contiguous:
+        order = "F"
+    else:
+        return None
+    return data.reshape(-1, order=order), np.asarray(m, dtype=bool).reshape(-1, order=order)
+
+
+def _robust_stats_jit(x: np.ndarray, m: np.ndarray) -> dict:
+    """Normalization statistics from fused JIT passes over flat data/mask views."""
+    n, mn, mx = _masked_range(x, m, 0.0, False)
+    if n < 10:
         # Fallback to whole-volume
-        m = np.ones_like(data, dtype=bool)
+        m = np.ones_like(m)
+        n, mn, mx = _masked_range(x, m, 0.0, False)
+    if mx <= mn:
+        mn, mx = mn - 0.5, mx + 0.5
+    cnt, s1, s2 = _masked_hist(x, m, 0.0, False, mn, mx, _HIST_BINS, numba.get_num_threads())
+    (i_lo, lo), (i_hi, hi), (_, med) = _hist_quantiles(cnt, mn, mx, [0.005, 0.995, 0.5])
 
-    vals = data[m]
-    lo, hi = np.percentile(vals, [0.5, 99.5])
-    vals_clipped = np.clip(vals, lo, hi)
-    mean = float(vals_clipped.mean())
-    std = float(vals_clipped.std() + 1e-6)
+    # lo/hi are bin edges, so clipped moments follow exactly from per-bin sums
+    n_lo = cnt[:i_lo].sum()
+    n_hi = cnt[i_hi:].sum()
+    sum1 = lo * n_lo + s1[i_lo:i_hi].sum() + hi * n_hi
+    sum2 = lo * lo * n_lo + s2[i_lo:i_hi].sum() + hi * hi * n_hi
+    mean = sum1 / n
+    std = float(np.sqrt(max(sum2 / n - mean * mean, 0.0)) + 1e-6)
 
-    data = np.clip(data, lo, hi)
-    data = (data - mean) / std
+    mad = _mad_jit(x, m, med)
+    return {"n": int(n), "lo": float(lo), "hi": float(hi), "mean": float(mean), "std": std, "med": float(med), "mad": float(mad)}
 
-    out = nib.Nifti1Image(data, img.affine, img.header)
-    nib.save(out, str(out_path))
 
-    # Stats + QC sidecar
+def _mad_jit(x: np.ndarray, m: np.ndarray, med: float) -> float:
+    """Histogram median of |x - med| over m, without materializing the deviations."""
+    _, dmn, dmx = _masked_range(x, m, med, True)
+    if dmx <= dmn:
+        dmn, dmx = dmn - 0.5, dmx + 0.5
+    dcnt, _, _ = _masked_hist(x, m, med, True, dmn, dmx, _HIST_BINS, numba.get_num_threads())
+    ((_, mad),) = _hist_quantiles(dcnt, dmn, dmx, [0.5])
+    return float(mad)
+
+
+def _mad(x: np.ndarray, med: float | None = None) -> float:
+    # Same histogram/left-edge rule as the fused JIT path, so the two cannot drift apart
+    if med is None:
+        med = _fast_pct(x, [0.5])[0]
+    if _masked_hist is not None:
+        x = np.ascontiguousarray(x).reshape(-1)
+        return _mad_jit(x, np.ones(x.shape, dtype=bool), med)
+    return _fast_pct(np.abs(x - med), [0.5])[0]
+
+
+def robust_normalize_arr(data: np.ndarray, affine: np.ndarray, mask_arr: np.ndarray) -> tuple[np.ndarray, dict]:
+    """Percentile-clip and z-score a float32 array in place using voxels inside mask_arr.
+
+    Returns the normalized array and a stats dict for the QC sidecar.
+    """
+    if data.shape != mask_arr.shape:
+        raise ValueError(f"Volume/mask shape mismatch: {data.shape} vs {mask_arr.shape}")
+    flat = _flat_views(data, mask_arr) if _masked_hist is not None else None
+    if flat is not None:
+        # Fused path: a few JIT passes over the flat views, then one in-place transform
+        x, mk = flat
+        st = _robust_stats_jit(x, mk)
+        mask_voxels, lo, hi, mean, std = st["n"], st["lo"], st["hi"], st["mean"], st["std"]
+        med, mad = st["med"], st["mad"]
+        _clip_zscore(x, np.float32(lo), np.float32(hi), np.float32(mean), np.float32(1.0 / std))
+    else:
+        m = mask_arr
+        if m.sum() < 10:
+            # Fallback to whole-volume
+            m = np.ones_like(data, dtype=bool)
+
+        vals = data[m]
+        lo, hi = _fast_pct(vals, [0.005, 0.995])
+        vals_clipped = np.clip(vals, lo, hi)
+        mean = float(vals_clipped.mean())
+        std = float(vals_clipped.std() + 1e-6)
+        med = _fast_pct(vals, [0.5])[0]
+        mad = _mad(vals, med)
+        mask_voxels = int(m.sum())
+
+        # Clip + z-score in place to avoid extra full-volume temporaries
+        np.clip(data, lo, hi, out=data)
+        np.subtract(data, mean, out=data)
+        np.multiply(data, 1.0 / std, out=data)
+
     try:
         from nibabel.orientations import aff2axcodes
 
-        ax = aff2axcodes(img.affine)
+        ax = aff2axcodes(affine)
         lr_ok = ax[0] == "R"
     except Exception:
         lr_ok = True
 
     stats = {
-        "input_path": str(in_file),
-        "output_path": str(out_path),
-        "mask_path": str(mask_file),
-        "mask_voxels": int(m.sum()),
+        "mask_voxels": mask_voxels,
         "p0p5_p99p5": [float(lo), float(hi)],
         "mean_std": [mean, std],
-        "median_MAD": [float(np.median(vals)), _mad(vals)],
+        "median_MAD": [med, mad],
         "lr_flip_suspect": not lr_ok,
         "warnings": [],
     }
@@ -63,8 +197,31 @@ def robust_normalize(in_file: Path, mask_file: Path, out_dir: Path, dry_run: boo
         stats["warnings"].append("Mask covers >90% of volume")
     if std < 1e-4:
         stats["warnings"].append("Low intensity variance after normalization")
+    return data, stats
+
+
+def robust_normalize(in_file: Path, mask_file: Path, out_dir: Path, dry_run: bool = False) -> Path:
+    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-norm.nii.gz")
+    if dry_run:
+        return out_path
+
+    img = nib.load(str(in_file))
+    # Read straight into float32; get_fdata() would materialize a float64 copy first
+    data = np.asarray(img.dataobj, dtype=np.float32)
+    m = np.asarray(nib.load(str(mask_file)).dataobj).astype(bool, copy=False)
+    data, norm_stats = robust_normalize_arr(data, img.affine, m)
+
+    out = nib.Nifti1Image(data, img.affine, img.header)
+    out.set_data_dtype(np.float32)
+    nib.save(out, str(out_path))
 
-    with open(str(out_path).replace(".nii.gz", ".json"), "w") as f:
-        json.dump(stats, f, indent=2)
+    # Stats + QC sidecar
+    stats = {
+        "input_path": str(in_file),
+        "output_path": str(out_path),
+        "mask_path": str(mask_file),
+        **norm_stats,
+    }
+    save_json(stats, Path(str(out_path).replace(".nii.gz", ".json")))
 
     return out_path
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
 import argparse
+import multiprocessing
+import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from typing import Iterable, Optional, Tuple, List, Dict
 
 import webdataset as wds
 
 from .slices import SliceSpec, extract_slices, pack_npz
+from .utils import limit_numba_threads
 
 
 def find_sessions(deriv_root: Path, subjects: Optional[Iterable[str]] = None, sessions: Optional[Iterable[str]] = None):
@@ -26,6 +31,40 @@ def infer_modality(path: Path) -> str:
     return "UNK"
 
 
+def _scan_final(final_dir: Path) -> Tuple[List[Path], List[Path]]:
+    """Return (masks, trains) from one scandir of a session's final/ directory."""
+    try:
+        with os.scandir(final_dir) as it:
+            names = [e.name for e in it]
+    except FileNotFoundError:
+        return [], []
+    # Same selection as the former globs: *_desc-brain_mask_space-iso*mm.nii.gz and *_desc-train.nii.gz
+    masks = sorted(
+        final_dir / n
+        for n in names
+        if n.endswith("mm.nii.gz") and "_desc-brain_mask_space-iso" in n[: -len("mm.nii.gz")]
+    )
+    trains = sorted(final_dir / n for n in names if n.endswith("_desc-train.nii.gz") and "_desc-mask_" not in n)
+    return masks, trains
+
+
+def _prepare_sample(it: Dict[str, str], spec: SliceSpec) -> Tuple[str, Optional[bytes]]:
+    """Extract and pack slices for one sample; returns (key, payload) with payload None if no brain."""
+    key = Path(it["train"]).name.replace(".nii.gz", "")
+    out = extract_slices(Path(it["train"]), Path(it["mask"]), spec)
+    if out is None:
+        return key, None
+    vol_s, msk_s, idx, meta = out
+    meta.update({
+        "subject": it["sub"],
+        "session": it["ses"],
+        "modality": it["mod"],
+        "train_path": it["train"],
+        "mask_path": it["mask"],
+    })
+    return key, pack_npz(vol_s, msk_s, meta)
+
+
 def parse_size(s: str) -> Tuple[int, int]:
     parts = [int(x) for x in s.lower().split("x")]
     if len(parts) != 2:
@@ -47,6 +86,7 @@ def make_wds(
     group_by_subject: bool = False,
     cov_start: float = 0.08,
     cov_end: float = 0.08,
+    n_jobs: int = 1,
     dry_run: bool = False,
 ):
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -60,13 +100,12 @@ def make_wds(
             continue
 
         # Final mask and training tensors only
-        masks = sorted((anat / "final").glob("*_desc-brain_mask_space-iso*mm.nii.gz"))
+        masks, trains = _scan_final(anat / "final")
         if not masks:
             print(f"No brain mask in {anat}, skipping {sub} {ses}")
             continue
         mask_path = masks[0]
 
-        trains = [p for p in sorted((anat / "final").glob("*_desc-train.nii.gz")) if "_desc-mask_" not in p.name]
         if not trains:
             print(f"No training tensors in {anat}, skipping {sub} {ses}")
             continue
@@ -90,51 +129,62 @@ def make_wds(
         print(f"[dry-run] would write {total} samples across {shards} shards with prefix {shard_prefix}_NNN.tar")
         return
 
+    spec = SliceSpec(count=slices_per_volume, target_size=slice_size, start_thr=cov_start, end_thr=cov_end)
+    prepare = partial(_prepare_sample, spec=spec)
+    ex = None
+    if n_jobs > 1:
+        # Slice extraction + packing runs in workers; tar writes stay in this process
+        # Split the cores between workers so the parallel boundary kernel does not oversubscribe
+        try:
+            n_cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            # sched_getaffinity is Linux-only
+            n_cpus = os.cpu_count() or 1
+        ex = ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=limit_numba_threads,
+            initargs=(max(1, n_cpus // n_jobs),),
+        )
+
     def write_shard(shard_idx: int, items: List[Dict[str, str]]):
         if not items:
             return
+        prepared = ex.map(prepare, items, chunksize=4) if ex is not None else map(prepare, items)
         shard_path = out_dir / f"{shard_prefix}_{shard_idx:03d}.tar"
         with wds.TarWriter(str(shard_path)) as sink:
-            for it in items:
-                spec = SliceSpec(count=slices_per_volume, target_size=slice_size, start_thr=cov_start, end_thr=cov_end)
-                vol = Path(it["train"])  # final train volume
-                msk = Path(it["mask"])   # final mask
-                out = extract_slices(vol, msk, spec)
-                if out is None:
-                    print(f"No brain coverage for {vol}, skipping")
+            for it, (key, payload) in zip(items, prepared):
+                if payload is None:
+                    print(f"No brain coverage for {it['train']}, skipping")
                     continue
-                vol_s, msk_s, idx, meta = out
-                meta.update({
-                    "subject": it["sub"],
-                    "session": it["ses"],
-                    "modality": it["mod"],
-                    "train_path": it["train"],
-                    "mask_path": it["mask"],
-                })
-                key = Path(it["train"]).name.replace(".nii.gz", "")
-                sink.write({"__key__": key, "slices.npz": pack_npz(vol_s, msk_s, meta)})
-
-    idx = start_index
-    if group_by_subject:
-        cur: List[Dict[str, str]] = []
-        for sub in sorted(by_subject.keys()):
-            subj_items = by_subject[sub]
-            if cur and (len(cur) + len(subj_items) > shard_size):
+                sink.write({"__key__": key, "slices.npz": payload})
+
+    try:
+        idx = start_index
+        if group_by_subject:
+            cur: List[Dict[str, str]] = []
+            for sub in sorted(by_subject.keys()):
+                subj_items = by_subject[sub]
+                if cur and (len(cur) + len(subj_items) > shard_size):
+                    write_shard(idx, cur)
+                    idx += 1
+                    cur = []
+                if len(subj_items) > shard_size and not cur:
+                    write_shard(idx, subj_items)
+                    idx += 1
+                else:
+                    cur.extend(subj_items)
+            if cur:
                 write_shard(idx, cur)
                 idx += 1
-                cur = []
-            if len(subj_items) > shard_size and not cur:
-                write_shard(idx, subj_items)
+        else:
+            for i in range(0, len(samples), shard_size):
+                write_shard(idx, samples[i : i + shard_size])
                 idx += 1
-            else:
-                cur.extend(subj_items)
-        if cur:
-            write_shard(idx, cur)
-            idx += 1
-    else:
-        for i in range(0, len(samples), shard_size):
-            write_shard(idx, samples[i : i + shard_size])
-            idx += 1
+    finally:
+        # Also reached when a worker raises; drop queued work instead of finishing it
+        if ex is not None:
+            ex.shutdown(cancel_futures=True)
 
 
 def main():
@@ -151,6 +201,7 @@ def main():
     ap.add_argument("--start-index", type=int, default=1, help="Starting shard index (default: 1)")
     ap.add_argument("--group-by-subject", action="store_true", help="Keep each subject's samples within the same shard when possible")
     ap.add_argument("--coverage-thresholds", default="0.08,0.08", help="Start,End mask coverage thresholds (0..1). E.g., 0.10,0.15")
+    ap.add_argument("--n-jobs", type=int, default=4, help="Parallel workers for slice extraction (default: 4)")
     ap.add_argument("--dry-run", action="store_true", help="Do not write shards; print actions")
     args = ap.parse_args()
 
@@ -181,6 +232,7 @@ def main():
         group_by_subject=args.group_by_subject,
         cov_start=cov_start,
         cov_end=cov_end,
+        n_jobs=max(1, args.n_jobs),
         dry_run=args.dry_run,
     )
 
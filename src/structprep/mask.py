@@ -2,17 +2,22 @@ from pathlib import Path
 
 import shutil
 import subprocess
-import numpy as np
-import nibabel as nib
-from skimage.morphology import ball, binary_dilation
+import SimpleITK as sitk
 
+from .utils import strip_nii_ext
 
-def _dilate_mask(mask: np.ndarray, aggressiveness: str) -> np.ndarray:
+
+def _dilate_mask(mask: sitk.Image, aggressiveness: str) -> sitk.Image:
     # Optional dilation to meet requested aggressiveness
     radius = {"liberal": 3, "medium": 2, "conservative": 1}.get(aggressiveness, 3)
     if radius <= 0:
         return mask
-    return binary_dilation(mask, ball(radius))
+    # ITK's binary dilation is multi-threaded and its cost does not grow with r^3
+    f = sitk.BinaryDilateImageFilter()
+    f.SetKernelRadius(radius)
+    f.SetKernelType(sitk.sitkBall)
+    f.SetForegroundValue(1)
+    return f.Execute(mask)
 
 
 def _ensure_cmd(cmd: str):
@@ -35,7 +40,7 @@ def _fs_brain_mask(in_file: Path, out_path: Path, tmp_dir: Path, dry_run: bool =
     _ensure_cmd("mri_watershed")
     _ensure_cmd("mri_binarize")
 
-    tmp_mgz = tmp_dir / (out_path.name.replace(".nii.gz", ".mgz"))
+    tmp_mgz = tmp_dir / (strip_nii_ext(out_path.name) + ".mgz")
 
     if not dry_run:
         # Watershed with requested tuning
@@ -54,11 +59,13 @@ def make_brain_mask(
     dry_run: bool = False,
     method: str = "freesurfer",
     fs_bin: Path | None = None,
+    compress: bool = True,
 ) -> Path:
     """Create brain mask using FreeSurfer only (mri_watershed + mri_binarize).
 
     - method: kept for backward compatibility, must be 'freesurfer'
     - aggressiveness: optional post-dilation to widen mask margins
+    - compress: write .nii.gz; pass False for transient work masks to skip gzip
     """
     # Allow FS bin path to be prepended to PATH (optional convenience)
     if fs_bin and fs_bin.exists():
@@ -73,16 +80,16 @@ def make_brain_mask(
     if chosen != "freesurfer":
         raise ValueError("Only 'freesurfer' mask method is supported")
 
-    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-brain_mask.nii.gz")
+    ext = ".nii.gz" if compress else ".nii"
+    out_path = out_dir / (strip_nii_ext(in_file.name) + "_desc-brain_mask" + ext)
     tmp_dir = out_dir
 
     if not dry_run:
         _fs_brain_mask(in_file, out_path, tmp_dir, dry_run=False)
 
-        # Optional dilation step to adjust aggressiveness
-        img = nib.load(str(out_path))
-        data = (img.get_fdata() > 0).astype(bool)
-        data = _dilate_mask(data, aggressiveness)
-        nib.save(nib.Nifti1Image(data.astype(np.uint8), img.affine, img.header), str(out_path))
+        # Optional dilation step to adjust aggressiveness (single read/write, in ITK)
+        img = sitk.ReadImage(str(out_path)) > 0
+        img = _dilate_mask(img, aggressiveness)
+        sitk.WriteImage(img, str(out_path))
 
     return out_path
@@ -1,18 +1,36 @@
+import shutil
 from pathlib import Path
 from typing import Tuple
 
 import nibabel as nib
+import numpy as np
+from nibabel.orientations import axcodes2ornt, io_orientation
 
+_RAS_ORNT = axcodes2ornt(("R", "A", "S"))
 
-def to_ras(in_file: Path, out_dir: Path, write: bool = True) -> Tuple[Path, dict]:
+
+def to_ras(in_file: Path, out_dir: Path, write: bool = True) -> Tuple[Path, dict, nib.Nifti1Image]:
     """Reorient to closest RAS canonical space.
 
-    Returns output path and minimal metadata.
+    Returns output path, minimal metadata and the reoriented image (so callers can read its
+    header without reopening the written file).
     """
     img = nib.load(str(in_file))
-    ras = nib.as_closest_canonical(img)
     out_name = in_file.name.replace(".nii.gz", "_desc-ras.nii.gz")
     out_path = out_dir / out_name
+    if np.array_equal(io_orientation(img.affine), _RAS_ORNT):
+        # Already RAS: copy the file rather than decoding and re-encoding the data
+        if write:
+            shutil.copy2(str(in_file), str(out_path))
+        meta = {
+            "InputFile": str(in_file),
+            "RAS": True,
+            "OriginalShape": list(img.shape),
+            "reorient": "noop",
+        }
+        return out_path, meta, img
+
+    ras = nib.as_closest_canonical(img)
     if write:
         nib.save(ras, str(out_path))
     meta = {
@@ -20,5 +38,5 @@ def to_ras(in_file: Path, out_dir: Path, write: bool = True) -> Tuple[Path, dict
         "RAS": True,
         "OriginalShape": list(img.shape),
     }
-    return out_path, meta
+    return out_path, meta, ras
 
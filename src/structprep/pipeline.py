@@ -1,22 +1,29 @@
-import json
+import multiprocessing
 import os
+import queue
 import shutil
+import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Dict, Iterable, List, Optional
 
 import numpy as np
+import SimpleITK as sitk
 
 from .bids import find_sessions, list_modality_files
 from .orient import to_ras
 from .target import choose_session_target
-from .register import coregister_affine, resample_with_lta, ensure_fs_tools, invert_lta
-from .bias import n4_bias_correct
+from .register import register_many, ensure_fs_tools
+from .bias import n4_bias_correct, n4_bias_correct_arr, n4_meta
 from .mask import make_brain_mask
-from .intensity import robust_normalize
-from .resample import resample_isotropic, crop_or_pad_center, resample_isotropic_mask
+from .intensity import robust_normalize_arr
+from .resample import resample_image_isotropic, crop_or_pad_image
 from .qc import save_mosaic
+from .utils import limit_numba_threads, save_json, strip_nii_ext
+
+# The parent fills the CPU-set queue through a feeder thread, so a worker may start before its item arrives
+CPU_SET_TIMEOUT_SEC = 10
 
 
 @dataclass
@@ -37,6 +44,33 @@ class ProcConfig:
     
 
 
+def _partition_cpus(n_jobs: int) -> Optional[list[set[int]]]:
+    """Split the CPUs this process may run on into n_jobs disjoint sets (None if not possible)."""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is Linux-only
+        return None
+    if len(cpus) < n_jobs:
+        return None
+    return [set(int(c) for c in chunk) for chunk in np.array_split(cpus, n_jobs)]
+
+
+def _worker_init(fs_bin: Optional[str], omp_nthreads: int, cpu_sets) -> None:
+    """One-time setup per worker process: FreeSurfer PATH, thread budget, CPU pinning."""
+    if fs_bin:
+        os.environ["PATH"] = fs_bin + ":" + os.environ.get("PATH", "")
+    os.environ["OMP_NUM_THREADS"] = str(omp_nthreads)
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(omp_nthreads)
+    limit_numba_threads(omp_nthreads)
+    if cpu_sets is not None:
+        # Each worker takes its own CPU set so per-job OMP/ITK threads do not overlap
+        try:
+            os.sched_setaffinity(0, cpu_sets.get(timeout=CPU_SET_TIMEOUT_SEC))
+        except (queue.Empty, AttributeError, OSError) as e:
+            print(f"Worker {os.getpid()} could not take a CPU set, running unpinned: {e!r}")
+
+
 def run_structprep(
     input_dir: Path,
     output_dir: Path,
@@ -65,6 +99,8 @@ def run_structprep(
     os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
     os.environ.setdefault("MKL_NUM_THREADS", "1")
     os.environ.setdefault("NUMEXPR_NUM_THREADS", "1")
+    # Cap ITK threads per job (inherited by forked workers) so N4/resampling stay within budget
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(max(1, omp_nthreads))
 
     cfg = ProcConfig(
         input_dir=input_dir,
@@ -102,7 +138,19 @@ def run_structprep(
             except Exception as e:
                 print(f"✗ Failed {sub} {ses}: {e}")
     else:
-        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        ctx = multiprocessing.get_context()
+        cpu_sets = None
+        parts = _partition_cpus(max_workers)
+        if parts is not None:
+            cpu_sets = ctx.Queue()
+            for part in parts:
+                cpu_sets.put(part)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=ctx,
+            initializer=_worker_init,
+            initargs=(str(fs_bin) if fs_bin else None, max(1, omp_nthreads), cpu_sets),
+        ) as ex:
             futs = {ex.submit(process_session, cfg, sub, ses): (sub, ses) for sub, ses in work}
             for fut in as_completed(futs):
                 sub, ses = futs[fut]
@@ -126,51 +174,62 @@ def process_session(cfg: ProcConfig, sub: str, ses: str):
     out_anat = Path(cfg.output_dir) / sub / ses / "anat"
     out_anat_final = out_anat / "final"
     out_anat_work = out_anat / "work"
+    if cfg.dry_run:
+        # Planning only: derive output names without opening any image or creating directories
+        _plan_session(cfg, sub, ses, files, out_anat_final, out_anat_work)
+        return
     out_anat_final.mkdir(parents=True, exist_ok=True)
     out_anat_work.mkdir(parents=True, exist_ok=True)
 
     # RAS for all inputs
     ras_files = {}
+    ras_hdrs = {}  # in-memory headers so target selection does not reopen the files
     for mod, paths in files.items():
         ras_files[mod] = []
         for p in paths:
-            ras_p, meta = to_ras(p, out_anat_work, write=not cfg.dry_run)
+            ras_p, meta, ras_img = to_ras(p, out_anat_work)
             ras_files[mod].append(ras_p)
-            if not cfg.dry_run:
-                with open(str(ras_p).replace(".nii.gz", "_desc-ras.json"), "w") as f:
-                    json.dump(meta, f, indent=2)
+            ras_hdrs[ras_p] = ras_img.header
+            save_json(meta, Path(str(ras_p).replace(".nii.gz", "_desc-ras.json")))
 
     # Choose session target by highest spatial resolution
     all_ras = [rp for lst in ras_files.values() for rp in lst]
-    target = choose_session_target(all_ras)
+    target = choose_session_target(all_ras, headers=ras_hdrs)
 
     # Coreg + resample onto target grid
     aligned = {}
     ltas = {}
+    movers = []
     for mod, paths in ras_files.items():
         aligned[mod] = []
         for mov in paths:
             if Path(mov).resolve() == Path(target).resolve():
                 # Target itself — copy as aligned output
                 out_mov = str(mov).replace("_desc-ras.nii.gz", "_space-sesTarget.nii.gz")
-                if not cfg.dry_run:
-                    shutil.copy2(mov, out_mov)
+                shutil.copy2(mov, out_mov)
                 aligned[mod].append(Path(out_mov))
                 # Create identity LTA sidecar for completeness
                 lta_path = out_mov.replace("_space-sesTarget.nii.gz", "_space-sesTarget_desc-affineToTarget_xfm.lta")
-                if not cfg.dry_run:
-                    with open(lta_path, "w") as f:
-                        f.write("# identity placeholder for target\n")
+                with open(lta_path, "w") as f:
+                    f.write("# identity placeholder for target\n")
                 ltas[(mov, target)] = Path(lta_path)
                 continue
+            # Placeholder keeps modality order; filled in once the batch finishes
+            aligned[mod].append(None)
+            movers.append((mod, len(aligned[mod]) - 1, mov))
 
-            lta = coregister_affine(mov=mov, ref=target, out_dir=out_anat_work, omp=cfg.omp_nthreads, dry_run=cfg.dry_run)
-            out_mov = resample_with_lta(mov=mov, ref=target, lta=lta, out_dir=out_anat_work, interp="trilinear", dry_run=cfg.dry_run)
-            aligned[mod].append(out_mov)
-            ltas[(mov, target)] = lta
-            # Also produce inverse LTA (target->mov) for convenience
-            inv_path = Path(str(lta).replace("_desc-affineToTarget_xfm.lta", "_desc-targetToMov_xfm.lta"))
-            invert_lta(lta, inv_path, dry_run=cfg.dry_run)
+    # Independent movers run concurrently within this session's thread budget
+    results = register_many(
+        [mov for _, _, mov in movers],
+        ref=target,
+        out_dir=out_anat_work,
+        omp=cfg.omp_nthreads,
+        interp="trilinear",
+        dry_run=cfg.dry_run,
+    )
+    for (mod, i, mov), (lta, out_mov, _inv) in zip(movers, results):
+        aligned[mod][i] = out_mov
+        ltas[(mov, target)] = lta
 
     # Determine reference for mask (prefer T1w, else target)
     ref_img = None
@@ -195,54 +254,130 @@ def process_session(cfg: ProcConfig, sub: str, ses: str):
         dry_run=cfg.dry_run,
         method=cfg.mask_method,
         fs_bin=cfg.fs_bin,
+        compress=False,  # transient; removed once the final mask is written
     )
 
     # Write a single binary mask into final/ matching the training grid
-    mask_iso = None
-    mask_final_path = None
-    if not cfg.dry_run:
-        mask_iso = resample_isotropic_mask(mask_path, iso_mm=cfg.iso_mm, out_dir=out_anat_work, dry_run=cfg.dry_run)
-        tmp_mask = crop_or_pad_center(
-            mask_iso,
-            target_shape=cfg.out_shape,
-            out_dir=out_anat_final,
-            dry_run=cfg.dry_run,
-            keep_depth=cfg.keep_depth,
-        )
-        # Rename to a clean, session-level name
-        mask_final_path = out_anat_final / f"{sub}_{ses}_desc-brain_mask_space-iso{cfg.iso_mm:g}mm.nii.gz"
-        try:
-            shutil.move(str(tmp_mask), str(mask_final_path))
-        except Exception:
-            mask_final_path = Path(tmp_mask)
+    mask_img = sitk.ReadImage(str(mask_path))
+    # Aligned images share the target grid, so the mask array is reused for every normalization
+    mask_arr = sitk.GetArrayViewFromImage(mask_img) > 0
+    mask_iso = resample_image_isotropic(mask_img, cfg.iso_mm, sitk.sitkNearestNeighbor)
+    mask_final = crop_or_pad_image(mask_iso, cfg.out_shape, keep_depth=cfg.keep_depth)
+    sitk.WriteImage(mask_final, str(_final_mask_path(cfg, sub, ses, out_anat_final)))
 
     # For each aligned image: optional N4, normalization, training export
     for mod, paths in aligned.items():
         for p in paths:
-            cur = p
-            if cfg.n4 and p != ref_img:
-                cur = n4_bias_correct(cur, out_dir=out_anat_work, dry_run=cfg.dry_run)
+            # The reference was already bias-corrected for masking; start from that output
+            # instead of the uncorrected image so N4 is neither skipped nor run twice
+            src = ref_bias if p == ref_img else p
+            train = _pipeline_volume(
+                cfg,
+                src,
+                mask_arr,
+                out_dir=out_anat_final,
+                work_dir=out_anat_work,
+                n4=cfg.n4 and p != ref_img,
+            )
+
+            # QC mosaic
+            save_mosaic(train, out_dir=out_anat_work)
+
+    # Remove work mask to reduce clutter now that final mask exists
+    try:
+        Path(mask_path).unlink(missing_ok=True)
+    except Exception:
+        pass
+
 
-            norm_p = cur
+def _final_mask_path(cfg: ProcConfig, sub: str, ses: str, out_dir: Path) -> Path:
+    return out_dir / f"{sub}_{ses}_desc-brain_mask_space-iso{cfg.iso_mm:g}mm.nii.gz"
+
+
+def _plan_session(
+    cfg: ProcConfig,
+    sub: str,
+    ses: str,
+    files: Dict[str, List[Path]],
+    out_dir: Path,
+    work_dir: Path,
+) -> None:
+    """Print the outputs process_session would write, using only path arithmetic.
+
+    The session target is picked from image headers at run time, so every input is listed
+    with its coregistration outputs; the one chosen as target is copied instead.
+    """
+    print(f"[dry-run] {sub} {ses}: {sum(len(v) for v in files.values())} inputs")
+    for mod, paths in files.items():
+        for p in paths:
+            ras = work_dir / p.name.replace(".nii.gz", "_desc-ras.nii.gz")
+            aligned = work_dir / ras.name.replace("_desc-ras.nii.gz", "_space-sesTarget.nii.gz")
+            lta = ras.name.replace("_desc-ras.nii.gz", "_space-sesTarget_desc-affineToTarget_xfm.lta")
+            inv = lta.replace("_desc-affineToTarget_xfm.lta", "_desc-targetToMov_xfm.lta")
+            name = strip_nii_ext(aligned.name)
+            if cfg.n4:
+                name += "_desc-biascorr"
             if cfg.normalize:
-                norm_p = robust_normalize(cur, mask_path, out_dir=out_anat_work, dry_run=cfg.dry_run)
+                name += "_desc-norm"
+            name += f"_space-iso{cfg.iso_mm:g}mm"
+            print(f"[dry-run]   {mod}: {p.name}")
+            print(f"[dry-run]     {ras}")
+            print(f"[dry-run]     {aligned} (+ {lta}, {inv})")
+            print(f"[dry-run]     {out_dir / (name + '_desc-train.nii.gz')}")
+    print(f"[dry-run]   mask: {_final_mask_path(cfg, sub, ses, out_dir)}")
 
-            # Export training tensor: isotropic + crop/pad
-            iso = resample_isotropic(norm_p, iso_mm=cfg.iso_mm, out_dir=out_anat_work, dry_run=cfg.dry_run)
-            train = crop_or_pad_center(iso, target_shape=cfg.out_shape, out_dir=out_anat_final, dry_run=cfg.dry_run, keep_depth=cfg.keep_depth)
 
-            # QC mosaic
-            if not cfg.dry_run:
-                save_mosaic(train, out_dir=out_anat_work)
+def _ras_affine(img: sitk.Image) -> np.ndarray:
+    """Voxel-to-RAS affine of an ITK image, built from its (LPS) geometry without reopening the file."""
+    aff = np.eye(4)
+    aff[:3, :3] = np.array(img.GetDirection()).reshape(3, 3) * np.array(img.GetSpacing())
+    aff[:3, 3] = img.GetOrigin()
+    return np.diag([-1.0, -1.0, 1.0, 1.0]) @ aff
 
-    # Remove work mask to reduce clutter now that final mask exists
-    if not cfg.dry_run:
-        try:
-            Path(mask_path).unlink(missing_ok=True)
-        except Exception:
-            pass
-        if mask_iso is not None:
-            try:
-                Path(mask_iso).unlink(missing_ok=True)
-            except Exception:
-                pass
+
+def _pipeline_volume(
+    cfg: ProcConfig,
+    in_path: Path,
+    mask_arr: np.ndarray,
+    out_dir: Path,
+    work_dir: Path,
+    n4: bool,
+) -> Path:
+    """N4 -> normalize -> isotropic resample -> crop/pad for one aligned volume, in memory.
+
+    Only the final training tensor is written (plus the N4/normalization JSON sidecars in
+    work_dir); file names match the former step-by-step chain.
+    """
+    name = strip_nii_ext(in_path.name)
+    img = sitk.Cast(sitk.ReadImage(str(in_path)), sitk.sitkFloat32)
+
+    # (stem, meta) sidecars, written once the final tensor path is known
+    sidecars = []
+    if n4:
+        start = time.time()
+        src = img
+        img = n4_bias_correct_arr(img)
+        name += "_desc-biascorr"
+        sidecars.append((name, n4_meta(src, in_path, None, time.time() - start)))
+
+    if cfg.normalize:
+        data = sitk.GetArrayFromImage(img)
+        # Transpose the (z, y, x) view back to nibabel order for the mask and affine
+        _, stats = robust_normalize_arr(data.T, _ras_affine(img), mask_arr.T)
+        norm = sitk.GetImageFromArray(data)
+        norm.CopyInformation(img)
+        img = norm
+        name += "_desc-norm"
+        sidecars.append((name, {"input_path": str(in_path), "output_path": None, **stats}))
+
+    # Export training tensor: isotropic + crop/pad
+    iso = resample_image_isotropic(img, cfg.iso_mm, sitk.sitkLinear)
+    name += f"_space-iso{cfg.iso_mm:g}mm"
+    train = crop_or_pad_image(iso, cfg.out_shape, keep_depth=cfg.keep_depth)
+    out_path = out_dir / f"{name}_desc-train.nii.gz"
+    sitk.WriteImage(train, str(out_path))
+
+    for stem, meta in sidecars:
+        meta["output_path"] = str(out_path)
+        save_json(meta, work_dir / f"{stem}.json")
+    return out_path
@@ -7,19 +7,19 @@ import matplotlib.pyplot as plt
 
 def save_mosaic(in_file: Path, out_dir: Path, n_slices: int = 12):
     img = nib.load(str(in_file))
-    data = img.get_fdata()
+    data = np.asarray(img.dataobj, dtype=np.float32)
     z_slices = np.linspace(0, data.shape[2] - 1, n_slices, dtype=int)
     ncols = 6
     nrows = int(np.ceil(n_slices / ncols))
-    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * 2, nrows * 2))
-    axes = axes.ravel()
-    for i, z in enumerate(z_slices):
-        axes[i].imshow(np.rot90(data[:, :, z]), cmap="gray")
-        axes[i].axis("off")
-    for j in range(i + 1, len(axes)):
-        axes[j].axis("off")
-    fig.tight_layout()
+    # (n, h, w) stack of rotated axial slices, each scaled to [0, 1] like a per-panel imshow
+    tiles = np.moveaxis(np.rot90(data[:, :, z_slices], axes=(0, 1)), -1, 0)
+    mn = tiles.min(axis=(1, 2), keepdims=True)
+    rng = tiles.max(axis=(1, 2), keepdims=True) - mn
+    tiles = (tiles - mn) / np.where(rng > 0, rng, 1.0)
+    # Blank tiles fill the last row, then the grid is laid out as one image and encoded once
+    n, h, w = tiles.shape
+    grid = np.zeros((nrows * ncols, h, w), dtype=np.float32)
+    grid[:n] = tiles
+    mosaic = grid.reshape(nrows, ncols, h, w).transpose(0, 2, 1, 3).reshape(nrows * h, ncols * w)
     out_png = out_dir / in_file.name.replace(".nii.gz", "_desc-qc_mosaic.png")
-    fig.savefig(out_png, dpi=100)
-    plt.close(fig)
-
+    plt.imsave(out_png, mosaic, cmap="gray", vmin=0.0, vmax=1.0)
@@ -1,7 +1,11 @@
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
 
 
 def ensure_fs_tools(fs_bin: Path | None):
@@ -38,7 +42,7 @@ def coregister_affine(mov: Path, ref: Path, out_dir: Path, omp: int, dry_run: bo
     ]
     env = {**os.environ, "OMP_NUM_THREADS": str(max(1, omp))}
     if not dry_run:
-        subprocess.run(cmd, check=True, env=env)
+        subprocess.run(cmd, check=True, env=env, stdout=subprocess.DEVNULL)
     return out_lta
 
 
@@ -49,6 +53,7 @@ def resample_with_lta(
     out_dir: Path,
     interp: str = "trilinear",
     dry_run: bool = False,
+    omp: Optional[int] = None,
 ) -> Path:
     out_img = out_dir / mov.name.replace("_desc-ras.nii.gz", "_space-sesTarget.nii.gz")
     cmd = [
@@ -64,13 +69,72 @@ def resample_with_lta(
         "--interp",
         interp,
     ]
+    env = {**os.environ, "OMP_NUM_THREADS": str(max(1, omp))} if omp else None
     if not dry_run:
-        subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, env=env, stdout=subprocess.DEVNULL)
     return out_img
 
 
+# Keys of an LTA "src/dst volume info" block (FreeSurfer writes c_ras; cras is also accepted)
+_VOLINFO_KEYS = ("valid", "filename", "volume", "voxelsize", "xras", "yras", "zras", "c_ras", "cras")
+
+
+def _parse_lta(path: Path) -> Optional[Tuple[List[str], np.ndarray, List[str], List[str], List[str]]]:
+    """Split a single-transform linear LTA into (header, 4x4 matrix, src info, dst info, trailer).
+
+    Returns None for anything else (several transforms, unknown type, missing volume info).
+    """
+    lines = [ln.rstrip() for ln in Path(path).read_text().splitlines()]
+    fields = {}
+    for ln in lines:
+        if "=" in ln and not ln.lstrip().startswith("#"):
+            k, v = ln.split("=", 1)
+            fields[k.strip()] = v.split("#", 1)[0].strip()
+    # 0 = LINEAR_VOX_TO_VOX, 1 = LINEAR_RAS_TO_RAS: both invert as matrix inverse + src/dst swap
+    if fields.get("nxforms") != "1" or fields.get("type") not in ("0", "1"):
+        return None
+    try:
+        m = next(i for i, ln in enumerate(lines) if ln.split() == ["1", "4", "4"])
+        mat = np.array([[float(v) for v in lines[m + 1 + r].split()] for r in range(4)])
+        s = lines.index("src volume info", m + 5)
+        d = lines.index("dst volume info", s + 1)
+    except (StopIteration, ValueError, IndexError):
+        return None
+    if mat.shape != (4, 4):
+        return None
+    e = d + 1
+    while e < len(lines) and lines[e].split("=", 1)[0].strip() in _VOLINFO_KEYS:
+        e += 1
+    return lines[: m + 1], mat, lines[s + 1 : d], lines[d + 1 : e], lines[e:]
+
+
+def _invert_lta_inline(in_lta: Path, out_lta: Path) -> bool:
+    """Write the inverse of a simple linear LTA without lta_convert; False if not handled."""
+    parsed = _parse_lta(in_lta)
+    if parsed is None:
+        return False
+    header, mat, src, dst, trailer = parsed
+    try:
+        inv = np.linalg.inv(mat)
+    except np.linalg.LinAlgError:
+        return False
+    header = [
+        f"# transform file {out_lta}" if ln.startswith("# transform file") else ln for ln in header
+    ]
+    rows = [" ".join(f"{v:.15e}" for v in row) for row in inv]
+    out = header + rows + ["src volume info"] + dst + ["dst volume info"] + src + trailer
+    Path(out_lta).write_text("\n".join(out) + "\n")
+    return True
+
+
 def invert_lta(in_lta: Path, out_lta: Path, dry_run: bool = False) -> Path:
-    """Create inverse LTA using lta_convert -invert."""
+    """Create inverse LTA: 4x4 inverse with src/dst volume info swapped.
+
+    Plain single-transform LTAs (what mri_coreg writes) are inverted in-process;
+    other variants fall back to lta_convert -invert.
+    """
+    if dry_run or _invert_lta_inline(in_lta, out_lta):
+        return out_lta
     cmd = [
         "lta_convert",
         "-invert",
@@ -79,6 +143,39 @@ def invert_lta(in_lta: Path, out_lta: Path, dry_run: bool = False) -> Path:
         "-outlta",
         str(out_lta),
     ]
-    if not dry_run:
-        subprocess.run(cmd, check=True)
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
     return out_lta
+
+
+def register_many(
+    movs: Sequence[Path],
+    ref: Path,
+    out_dir: Path,
+    omp: int,
+    interp: str = "trilinear",
+    dry_run: bool = False,
+) -> List[Tuple[Path, Path, Path]]:
+    """Coregister, resample and invert the transform for several movers onto one reference concurrently.
+
+    Each mover runs mri_coreg -> mri_vol2vol -> lta_convert as one chain, so one mover's
+    resample overlaps the next one's registration. The omp thread budget is split across the
+    concurrent jobs (mri_coreg scales poorly past a few threads, so several narrow jobs beat
+    one wide one). Tool stdout is discarded; errors still surface via stderr and check=True.
+    Returns (lta, resampled image, inverse lta) per mover, in input order.
+    """
+    if not movs:
+        return []
+    workers = max(1, min(len(movs), omp))
+    per_job = max(1, omp // workers)
+
+    def _one(mov: Path) -> Tuple[Path, Path, Path]:
+        lta = coregister_affine(mov=mov, ref=ref, out_dir=out_dir, omp=per_job, dry_run=dry_run)
+        out = resample_with_lta(mov=mov, ref=ref, lta=lta, out_dir=out_dir, interp=interp, dry_run=dry_run, omp=per_job)
+        # Also produce inverse LTA (target->mov) for convenience
+        inv = Path(str(lta).replace("_desc-affineToTarget_xfm.lta", "_desc-targetToMov_xfm.lta"))
+        invert_lta(lta, inv, dry_run=dry_run)
+        return lta, out, inv
+
+    # The work runs in FreeSurfer subprocesses, so threads are enough to overlap them
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_one, movs))
@@ -1,67 +1,31 @@
-from pathlib import Path
 from typing import Tuple
 
-import nibabel as nib
 import numpy as np
 import SimpleITK as sitk
 
 
-def resample_isotropic(in_file: Path, iso_mm: float, out_dir: Path, dry_run: bool = False) -> Path:
-    out_path = out_dir / in_file.name.replace(".nii.gz", f"_space-iso{iso_mm:g}mm.nii.gz")
-    if dry_run:
-        return out_path
-
-    img = sitk.ReadImage(str(in_file))
+def resample_image_isotropic(img: sitk.Image, iso_mm: float, interp: int = sitk.sitkLinear) -> sitk.Image:
+    """Resample an in-memory image to isotropic spacing, preserving FOV, origin and direction."""
     spacing = np.array(img.GetSpacing(), dtype=float)
     # Compute new size to preserve FOV
     new_spacing = np.array([iso_mm, iso_mm, iso_mm], dtype=float)
     new_size = np.round(np.array(img.GetSize()) * (spacing / new_spacing)).astype(int)
 
     resampler = sitk.ResampleImageFilter()
-    resampler.SetInterpolator(sitk.sitkLinear)
-    resampler.SetOutputSpacing(tuple(new_spacing.tolist()))
-    resampler.SetSize([int(x) for x in new_size.tolist()])
-    resampler.SetOutputOrigin(img.GetOrigin())
-    resampler.SetOutputDirection(img.GetDirection())
-    out = resampler.Execute(img)
-    sitk.WriteImage(out, str(out_path))
-    return out_path
-
-def resample_isotropic_mask(in_file: Path, iso_mm: float, out_dir: Path, dry_run: bool = False) -> Path:
-    """Resample mask to isotropic spacing using nearest neighbor."""
-    out_path = out_dir / in_file.name.replace(".nii.gz", f"_space-iso{iso_mm:g}mm_desc-mask.nii.gz")
-    if dry_run:
-        return out_path
-
-    img = sitk.ReadImage(str(in_file))
-    spacing = np.array(img.GetSpacing(), dtype=float)
-    new_spacing = np.array([iso_mm, iso_mm, iso_mm], dtype=float)
-    new_size = np.round(np.array(img.GetSize()) * (spacing / new_spacing)).astype(int)
-
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+    resampler.SetInterpolator(interp)
     resampler.SetOutputSpacing(tuple(new_spacing.tolist()))
     resampler.SetSize([int(x) for x in new_size.tolist()])
     resampler.SetOutputOrigin(img.GetOrigin())
     resampler.SetOutputDirection(img.GetDirection())
-    out = resampler.Execute(img)
-    sitk.WriteImage(out, str(out_path))
-    return out_path
+    return resampler.Execute(img)
 
 
-def crop_or_pad_center(
-    in_file: Path,
+def crop_or_pad_array(
+    data: np.ndarray,
     target_shape: Tuple[int, int, int],
-    out_dir: Path,
-    dry_run: bool = False,
     keep_depth: bool = False,
-) -> Path:
-    out_path = out_dir / in_file.name.replace(".nii.gz", "_desc-train.nii.gz")
-    if dry_run:
-        return out_path
-
-    img = nib.load(str(in_file))
-    data = img.get_fdata()
+) -> np.ndarray:
+    """Center crop/pad a (D, H, W) array to target_shape; returns float32."""
     tgt = np.array(target_shape, dtype=int)
     cur = np.array(data.shape[:3], dtype=int)
 
@@ -70,31 +34,29 @@ def crop_or_pad_center(
         # Preserve current depth; only standardize H and W
         tgt[0] = cur[0]
 
-    # Pad
-    pad = np.maximum(tgt - cur, 0)
-    pad_before = (pad // 2).astype(int)
-    pad_after = (pad - pad_before).astype(int)
-    if keep_depth or tgt[0] == cur[0]:
-        pad_before[0] = 0
-        pad_after[0] = 0
-    if pad.sum() > 0:
-        data = np.pad(
-            data,
-            ((pad_before[0], pad_after[0]), (pad_before[1], pad_after[1]), (pad_before[2], pad_after[2])),
-            mode="constant",
-            constant_values=0,
-        )
+    # Copy the centered overlap straight into a zeroed float32 buffer: padded axes get a
+    # destination offset, cropped axes a source offset
+    src_start = np.maximum((cur - tgt) // 2, 0)
+    dst_start = np.maximum((tgt - cur) // 2, 0)
+    extent = np.minimum(cur, tgt)
+    out = np.zeros(tuple(int(x) for x in tgt), dtype=np.float32)
+    out[tuple(slice(d, d + e) for d, e in zip(dst_start, extent))] = data[
+        tuple(slice(s, s + e) for s, e in zip(src_start, extent))
+    ]
+    return out
+
 
-    # Crop centered
-    cur2 = np.array(data.shape[:3], dtype=int)
-    start = np.maximum((cur2 - tgt) // 2, 0)
-    end = start + tgt
-    if keep_depth or tgt[0] == cur2[0]:
-        # Only crop H and W; keep full depth
-        data = data[:, start[1] : end[1], start[2] : end[2]]
-    else:
-        data = data[start[0] : end[0], start[1] : end[1], start[2] : end[2]]
+def crop_or_pad_image(
+    img: sitk.Image,
+    target_shape: Tuple[int, int, int],
+    keep_depth: bool = False,
+) -> sitk.Image:
+    """Center crop/pad an in-memory image; the origin/spacing/direction and pixel type of the input are kept."""
+    # SimpleITK arrays are (z, y, x); transpose to the nibabel (i, j, k) order used for target_shape
+    data = crop_or_pad_array(sitk.GetArrayViewFromImage(img).T, target_shape, keep_depth=keep_depth)
+    out = sitk.Cast(sitk.GetImageFromArray(np.ascontiguousarray(data.T)), img.GetPixelID())
+    out.SetOrigin(img.GetOrigin())
+    out.SetSpacing(img.GetSpacing())
+    out.SetDirection(img.GetDirection())
+    return out
 
-    out = nib.Nifti1Image(data.astype(np.float32), img.affine, img.header)
-    nib.save(out, str(out_path))
-    return out_path
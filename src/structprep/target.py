@@ -1,23 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Mapping, Optional
 
 import nibabel as nib
 import numpy as np
+from nibabel.openers import ImageOpener
 
+# sizeof_hdr field of a NIfTI-1 header, in either byte order
+_NIFTI1_SIZEOF_HDR = ((348).to_bytes(4, "little"), (348).to_bytes(4, "big"))
 
-def choose_session_target(ras_files: List[Path]) -> Path:
+
+def _read_header(p: Path) -> nib.Nifti1Header:
+    """Read just the NIfTI-1 header (348 bytes, gunzipped on the fly if needed)."""
+    with ImageOpener(str(p), "rb") as f:
+        if f.read(4) in _NIFTI1_SIZEOF_HDR:
+            f.seek(0)
+            return nib.Nifti1Header.from_fileobj(f)
+    # Not NIfTI-1 (e.g. NIfTI-2): let nibabel pick the image class
+    return nib.load(str(p)).header
+
+
+def choose_session_target(
+    ras_files: List[Path],
+    headers: Optional[Mapping[Path, nib.Nifti1Header]] = None,
+) -> Path:
     """Pick the highest spatial resolution image as target.
 
     Criterion: minimal voxel volume (product of voxel sizes), tie-break by largest matrix size.
+    headers: optional in-memory headers keyed by path; files not in it are read from disk.
     """
+    hdrs = {p: headers.get(p) for p in ras_files} if headers else dict.fromkeys(ras_files)
+    missing = [p for p, h in hdrs.items() if h is None]
+    if len(missing) > 1:
+        # Header reads are small and I/O bound; overlap them
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+            hdrs.update(zip(missing, ex.map(_read_header, missing)))
+    elif missing:
+        hdrs[missing[0]] = _read_header(missing[0])
+
     best = None
     best_voxvol = None
     best_mat = None
     for p in ras_files:
-        img = nib.load(str(p))
-        zooms = np.array(img.header.get_zooms()[:3])
+        hdr = hdrs[p]
+        zooms = np.array(hdr.get_zooms()[:3])
         voxvol = float(np.prod(zooms))
-        matsz = int(np.prod(img.shape[:3]))
+        matsz = int(np.prod(hdr.get_data_shape()[:3]))
         if (
             best is None
             or voxvol < best_voxvol
@@ -28,4 +56,3 @@ def choose_session_target(ras_files: List[Path]) -> Path:
             best_mat = matsz
     assert best is not None
     return best
-
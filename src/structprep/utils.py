@@ -3,9 +3,47 @@ from __future__ import annotations
 import json
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used instead
+    orjson = None
+
+
+def strip_nii_ext(name: str) -> str:
+    """Drop a trailing .nii.gz or .nii extension from a filename."""
+    for ext in (".nii.gz", ".nii"):
+        if name.endswith(ext):
+            return name[: -len(ext)]
+    return name
+
+
+def limit_numba_threads(n: int) -> None:
+    """Cap numba's parallel kernels at n threads in this process; no-op without numba.
+
+    numba sizes its pool from the machine's cores when first imported, which happens
+    before worker processes are pinned to their CPU sets.
+    """
+    try:
+        import numba
+    except ImportError:
+        return
+    numba.set_num_threads(max(1, min(n, numba.config.NUMBA_NUM_THREADS)))
+
 
 def save_json(obj: dict, out_path: Path):
+    """Write obj as indented JSON; numpy scalars/arrays are serialized natively."""
+    out_path = Path(out_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    if orjson is not None:
+        out_path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        return
     with open(out_path, "w") as f:
-        json.dump(obj, f, indent=2)
+        json.dump(obj, f, indent=2, default=_json_default)
+
+
+def _json_default(o):
+    # numpy arrays and scalars both expose tolist()
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
 
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from structprep import intensity
+from structprep.intensity import robust_normalize_arr
+
+AFFINE = np.eye(4)
+
+
+def _volume(order: str = "C") -> tuple[np.ndarray, np.ndarray]:
+    """Noisy bright ellipsoid with a bias ramp, plus its mask."""
+    x, y, z = np.mgrid[0:48, 56:0:-1, 0:40]
+    mask = np.hypot(np.hypot(x - 24, y - 28), (z - 20) * 1.3) < 18
+    rng = np.random.default_rng(0)
+    data = (mask * 200 + rng.gamma(2.0, 15.0, mask.shape)) * (1 + x / 96)
+    return np.asarray(data, dtype=np.float32, order=order), np.asarray(mask, order=order)
+
+
+def _numpy_path(monkeypatch, data: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, dict]:
+    # Hide the kernels so robust_normalize_arr and _mad take the numpy fallback
+    with monkeypatch.context() as mp:
+        mp.setattr(intensity, "_masked_hist", None)
+        return robust_normalize_arr(data.copy(order="K"), AFFINE, mask)
+
+
+def _assert_stats_close(a: dict, b: dict) -> None:
+    assert a["mask_voxels"] == b["mask_voxels"]
+    for key in ("p0p5_p99p5", "mean_std", "median_MAD"):
+        np.testing.assert_allclose(a[key], b[key], rtol=1e-5)
+    assert a["warnings"] == b["warnings"]
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_jit_matches_numpy_fallback(monkeypatch, order: str):
+    pytest.importorskip("numba")
+    data, mask = _volume(order)
+    ref, ref_stats = _numpy_path(monkeypatch, data, mask)
+    out, stats = robust_normalize_arr(data.copy(order="K"), AFFINE, mask)
+
+    assert out.flags.f_contiguous == (order == "F")
+    _assert_stats_close(stats, ref_stats)
+    np.testing.assert_allclose(out, ref, rtol=1e-5, atol=1e-5)
+
+
+def test_layouts_agree(monkeypatch):
+    # C, F and non-contiguous inputs reach different paths but must normalize identically
+    data, mask = _volume("C")
+    ref, ref_stats = _numpy_path(monkeypatch, data, mask)
+    for arr, msk in (
+        (np.asfortranarray(data), np.asfortranarray(mask)),
+        (data.T.copy().T, mask),  # F-ordered data with a C-ordered mask
+        (data.astype(np.float64), mask),
+    ):
+        out, stats = robust_normalize_arr(arr.copy(order="K"), AFFINE, msk)
+        _assert_stats_close(stats, ref_stats)
+        np.testing.assert_allclose(out, ref, rtol=1e-5, atol=1e-5)
+
+
+def test_tiny_mask_falls_back_to_whole_volume(monkeypatch):
+    data, _ = _volume()
+    mask = np.zeros(data.shape, dtype=bool)
+    mask[0, 0, :5] = True
+    _, ref_stats = _numpy_path(monkeypatch, data, mask)
+    _, stats = robust_normalize_arr(data.copy(), AFFINE, mask)
+    assert stats["mask_voxels"] == data.size
+    _assert_stats_close(stats, ref_stats)
+
+
+def test_shape_mismatch_raises():
+    data, mask = _volume()
+    with pytest.raises(ValueError, match="shape mismatch"):
+        robust_normalize_arr(data, AFFINE, mask[:, :, :-1])
+    with pytest.raises(ValueError, match="shape mismatch"):
+        robust_normalize_arr(data, AFFINE, mask.T)
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import numpy as np
+
+from structprep.register import _parse_lta, invert_lta
+
+# Layout as written by mri_coreg / lta_convert
+LTA = """\
+# transform file /data/work/sub-01_ses-01_FLAIR_space-sesTarget_desc-affineToTarget_xfm.lta
+# created by mri_coreg
+type      = 1 # LINEAR_RAS_TO_RAS
+nxforms   = 1
+mean      = 0.0000 0.0000 0.0000
+sigma     = 1.0000
+1 4 4
+9.998477101325989e-01 -1.745240576565266e-02 0.000000000000000e+00 2.500000000000000e+00
+1.745240576565266e-02 9.998477101325989e-01 0.000000000000000e+00 -1.250000000000000e+00
+0.000000000000000e+00 0.000000000000000e+00 1.000000000000000e+00 3.000000000000000e+00
+0.000000000000000e+00 0.000000000000000e+00 0.000000000000000e+00 1.000000000000000e+00
+src volume info
+valid = 1  # volume info valid
+filename = /data/work/sub-01_ses-01_FLAIR_desc-ras.nii.gz
+volume = 256 256 176
+voxelsize = 1.000000000000000e+00 1.000000000000000e+00 1.200000000000000e+00
+xras   = 1.000000000000000e+00 0.000000000000000e+00 0.000000000000000e+00
+yras   = 0.000000000000000e+00 1.000000000000000e+00 0.000000000000000e+00
+zras   = 0.000000000000000e+00 0.000000000000000e+00 1.000000000000000e+00
+c_ras  = -4.000000000000000e+00 5.000000000000000e+00 -6.000000000000000e+00
+dst volume info
+valid = 1  # volume info valid
+filename = /data/work/sub-01_ses-01_T1w_desc-ras.nii.gz
+volume = 256 256 256
+voxelsize = 1.000000000000000e+00 1.000000000000000e+00 1.000000000000000e+00
+xras   = -1.000000000000000e+00 0.000000000000000e+00 0.000000000000000e+00
+yras   = 0.000000000000000e+00 0.000000000000000e+00 1.000000000000000e+00
+zras   = 0.000000000000000e+00 -1.000000000000000e+00 0.000000000000000e+00
+c_ras  = 1.000000000000000e+00 2.000000000000000e+00 3.000000000000000e+00
+subject unknown
+fscale 0.100000
+"""
+
+
+def test_invert_lta_swaps_volume_info(tmp_path: Path):
+    src = tmp_path / "fwd.lta"
+    src.write_text(LTA)
+    inv = invert_lta(src, tmp_path / "inv.lta")
+
+    _, mat, src_info, dst_info, trailer = _parse_lta(src)
+    _, inv_mat, inv_src, inv_dst, inv_trailer = _parse_lta(inv)
+    np.testing.assert_allclose(mat @ inv_mat, np.eye(4), atol=1e-12)
+    # Each block moves whole, including its own c_ras line
+    assert inv_src == dst_info and inv_dst == src_info
+    assert sum(ln.startswith("c_ras") for ln in inv_src) == 1
+    assert sum(ln.startswith("c_ras") for ln in inv_dst) == 1
+    assert inv_trailer == trailer
+
+
+def test_invert_lta_round_trip(tmp_path: Path):
+    src = tmp_path / "fwd.lta"
+    src.write_text(LTA)
+    back = invert_lta(invert_lta(src, tmp_path / "inv.lta"), tmp_path / "back.lta")
+
+    orig = src.read_text().splitlines()
+    again = back.read_text().splitlines()
+    # Only the transform-file comment and the matrix formatting may differ
+    m = orig.index("1 4 4")
+    assert again[1 : m + 1] == orig[1 : m + 1]
+    assert again[m + 5 :] == orig[m + 5 :]
+    np.testing.assert_allclose(_parse_lta(back)[1], _parse_lta(src)[1], atol=1e-12)
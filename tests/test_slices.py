@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from structprep import slices
+from structprep.slices import _brain_boundaries
+
+
+def _numpy_boundaries(monkeypatch, mask: np.ndarray, thr_start: float, thr_end: float):
+    with monkeypatch.context() as mp:
+        mp.setattr(slices, "_boundaries_kernel", None)
+        return _brain_boundaries(mask, thr_start, thr_end)
+
+
+def _masks():
+    x, y, z = np.mgrid[0:40, 0:36, 0:30]
+    ball = np.hypot(np.hypot(x - 20, y - 18), (z - 12) * 1.2) < 14
+    yield ball
+    yield np.asfortranarray(ball)
+    yield ball.astype(np.uint8)
+    yield ball[:, ::2, :]  # non-contiguous view
+    yield np.zeros((8, 8, 5), dtype=bool)  # no brain
+    yield np.ones((0, 4, 3), dtype=bool)  # empty slices
+
+
+@pytest.mark.parametrize("thr", [(0.0, 0.0), (0.08, 0.08), (0.05, 0.2), (0.3, 0.3), (0.9, 0.9)])
+def test_kernel_matches_numpy(monkeypatch, thr):
+    pytest.importorskip("numba")
+    for mask in _masks():
+        a, b, cov = _brain_boundaries(mask, *thr)
+        ra, rb, rcov = _numpy_boundaries(monkeypatch, mask, *thr)
+        assert (a, b) == (ra, rb)
+        assert cov.dtype == rcov.dtype == np.float32
+        np.testing.assert_array_equal(cov, rcov)
+
+
+def test_numpy_boundaries(monkeypatch):
+    mask = np.zeros((10, 10, 6), dtype=bool)
+    mask[:5, :, 1] = True  # 50% coverage
+    mask[:, :, 2:4] = True
+    mask[:1, :, 4] = True  # 10% coverage
+    a, b, cov = _numpy_boundaries(monkeypatch, mask, 0.2, 0.05)
+    assert (a, b) == (1, 4)
+    np.testing.assert_allclose(cov, [0.0, 0.5, 1.0, 1.0, 0.1, 0.0])
+    assert _numpy_boundaries(monkeypatch, mask, 1.1, 1.1)[:2] == (None, None)